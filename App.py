@@ -4,6 +4,9 @@ from enum import Enum, auto
 import time
 
 from summarizer import summarize_debate
+from llm import get_role_stats, IncompleteResponse, response_errors
+from archive import Archive
+from cancellation import get_cancellation_stats
 
 
 # Custom CSS to make the app use more screen space
@@ -130,12 +133,19 @@ def main():
                 # Create a panel for the guests
                 st.subheader("👥 Our Distinguished Guests")
                 with st.spinner("Inviting guests..."):
+                    if "host" in st.session_state:
+                        # Stop whatever the previous host still has in flight
+                        st.session_state.host.cancel()
                     st.session_state.host = Host(topic, display_mode="streamlit")
                     # Invite guests one by one with a placeholder
                     placeholder = st.empty()
-                    for guest in st.session_state.host.invite_guests_one_by_one():
-                        with placeholder.container():
-                            st.write(f"Inviting {guest.name}...")
+                    try:
+                        for guest in st.session_state.host.invite_guests_one_by_one():
+                            with placeholder.container():
+                                st.write(f"Inviting {guest.name}...")
+                    except response_errors as error:
+                        st.error(f"Inviting the guests failed, please try again. ({error})")
+                        st.stop()
                     
                     print("done inviting guests")
                     # Clear the placeholder and rerun to switch to guest display
@@ -150,9 +160,17 @@ def main():
         for i, guest in enumerate(st.session_state.host.guests.values()):
             display_guest_profile(guest, i)
 
-        st.session_state.host.plan_debate(num_steps=st.session_state["max_rounds"])
+        try:
+            st.session_state.host.plan_debate(num_steps=st.session_state["max_rounds"])
+        except IncompleteResponse as error:
+            st.error(f"The debate plan was cut off, try fewer debate rounds. ({error})")
+            st.stop()
+        except response_errors as error:
+            st.error(f"Planning the debate failed, please reload the page to try again. ({error})")
+            st.stop()
         # Add a start debate button
         if st.button("Start Debate"):
+            st.session_state["plan"] = list(st.session_state.host.debate_plan)
             st.session_state["state"] = "debate"
             st.rerun()
     elif st.session_state["state"] == "debate":
@@ -171,16 +189,45 @@ def main():
             messages = []
             # Stream the debate messages
             with debate_container.container():
-                for message, name in host.run_debate():
-                    display_message_stream(message, name)
-                    messages.append((message, name))
+                try:
+                    for message, name in host.run_debate():
+                        display_message_stream(message, name)
+                        messages.append((message, name))
+                except response_errors as error:
+                    # Summarize what was said so far rather than losing the whole debate
+                    st.session_state["debate_error"] = str(error)
             st.session_state["messages"] = messages
             st.session_state["state"] = "debate_overview"
             st.rerun()
     elif st.session_state["state"] == "debate_overview":
-        summary = summarize_debate(st.session_state["messages"], st.session_state.host.debate_topic)
+        host = st.session_state.host
+        if "debate_error" in st.session_state:
+            st.warning(f"The debate ended early: {st.session_state['debate_error']}")
+        if "summary" not in st.session_state:
+            try:
+                st.session_state["summary"] = summarize_debate(st.session_state["messages"], host.debate_topic, host.cancel_token)
+            except response_errors as error:
+                st.error(f"Summarizing the debate failed, please reload the page to try again. ({error})")
+                st.stop()
+            Archive(host.name_encoder).add_debate(
+                host.debate_topic,
+                host.guests.values(),
+                st.session_state["plan"],
+                st.session_state["summary"],
+                st.session_state["messages"],
+            )
         with st.expander("🎯 Debate Summary", expanded=True):
-            st.write(summary)
+            st.write(st.session_state["summary"])
+        with st.expander("⏱️ Model Usage per Role", expanded=False):
+            st.table(get_role_stats())
+            st.write("Saved by cancelling work that was no longer needed:")
+            st.table(get_cancellation_stats())
+        with st.expander("🗄️ Search Past Debates", expanded=False):
+            query = st.text_input("Similar to")
+            keyword = st.text_input("Containing")
+            if query or keyword:
+                for result in Archive(host.name_encoder).search(query=query or None, keyword=keyword or None):
+                    st.markdown(f"**{result['speaker']}** on *{result['topic']}*: {result['message']}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,327 @@
+"""
+This defines the archive of finished debates. It keeps every transcript searchable by keyword and by meaning.
+"""
+
+import os
+import re
+import json
+import hashlib
+import threading
+from datetime import datetime
+from typing import List, Tuple, Dict, Any, Optional, Iterable
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from config import archive_dir
+from guest import Guest
+from file_lock import exclusive_lock
+
+# Shared by all Archive instances, since every Streamlit session creates its own
+_archive_lock = threading.Lock()
+
+
+class Archive:
+    """
+    Append-only store of debates.
+
+    Debate metadata (topic, guests, plan, summary) is appended to a JSON lines file. Messages are
+    stored column by column in raw files that are only ever appended to:
+    - debate_id.i32: the debate each message belongs to
+    - speaker.i32: the speaker of each message, as an index into speakers.json
+    - text.bin / text_end.i64: the UTF-8 encoded messages and the offset at which each one ends
+    - embedding.f32: the normalized MiniLM embedding of each message
+    - keywords/<bucket>.token.i64 / keywords/<bucket>.row.i32: the keyword index, one posting (hashed term,
+      message) per distinct word and pair of adjacent words of each message, split into buckets by hash so a
+      lookup only scans a fraction of it
+    All columns are memory-mapped when searching, so the archive never has to fit into memory.
+    Writers hold a lock shared by all instances in this process and a file lock shared between processes.
+    """
+
+    search_chunk_size = 1 << 18  # Rows scored at once during semantic search
+    keyword_buckets = 64
+
+    def __init__(self, encoder: SentenceTransformer, directory: str = archive_dir):
+        self.encoder = encoder
+        self.directory = directory
+        self.dim = encoder.get_sentence_embedding_dimension()
+        os.makedirs(os.path.join(directory, "keywords"), exist_ok=True)
+        self.reload()
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def reload(self) -> None:
+        """Read the debates and speakers, which other instances may have added to since."""
+        self.debates: List[Dict[str, Any]] = []
+        if os.path.exists(self.path("debates.jsonl")):
+            with open(self.path("debates.jsonl"), "r") as file:
+                # A line without a newline is still being written
+                self.debates = [json.loads(line) for line in file if line.endswith("\n")]
+        self.speakers: List[str] = []
+        if os.path.exists(self.path("speakers.json")):
+            with open(self.path("speakers.json"), "r") as file:
+                self.speakers = json.load(file)
+        self.speaker_codes = {speaker: code for code, speaker in enumerate(self.speakers)}
+
+    def write_lock(self):
+        """Hold the archive exclusively, across instances and, where possible, processes."""
+        return exclusive_lock(self.path("lock"), _archive_lock)
+
+    def column(self, name: str, dtype: np.dtype, width: int = 1) -> np.ndarray:
+        """Memory-map a column file, ignoring a partially written trailing row."""
+        path = self.path(name)
+        row_size = np.dtype(dtype).itemsize * width
+        rows = os.path.getsize(path) // row_size if os.path.exists(path) else 0
+        if rows == 0:
+            return np.empty((0, width) if width > 1 else 0, dtype=dtype)
+        shape = (rows, width) if width > 1 else (rows,)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    @staticmethod
+    def hash_term(term: str) -> int:
+        """Hash a term stably across processes."""
+        return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little", signed=True)
+
+    @classmethod
+    def index_terms(cls, text: str) -> List[int]:
+        """Hash the distinct lowercase words and pairs of adjacent words of a message."""
+        words = re.findall(r"\w+", text.lower())
+        pairs = [f"{first} {second}" for first, second in zip(words, words[1:])]
+        return [cls.hash_term(term) for term in dict.fromkeys(words + pairs)]
+
+    @classmethod
+    def query_terms(cls, keyword: str) -> List[int]:
+        """Hash the terms a message must contain to match the keyword: its word, or each pair of adjacent words of a phrase."""
+        words = re.findall(r"\w+", keyword.lower())
+        if len(words) == 1:
+            return [cls.hash_term(words[0])]
+        return [cls.hash_term(f"{first} {second}") for first, second in dict.fromkeys(zip(words, words[1:]))]
+
+    def keyword_column(self, bucket: int, kind: str, dtype: np.dtype) -> np.ndarray:
+        return self.column(os.path.join("keywords", f"{bucket}.{kind}"), dtype)
+
+    def num_messages(self) -> int:
+        """Number of messages of debates whose metadata has been written, i.e. that were archived completely."""
+        if not self.debates:
+            return 0
+        return self.debates[-1]["first_message"] + self.debates[-1]["num_messages"]
+
+    def discard_incomplete(self, num_messages: int) -> None:
+        """Cut off rows left behind by an interrupted add_debate, so the columns stay aligned."""
+        text_end = self.column("text_end.i64", np.int64)
+        text_size = int(text_end[num_messages - 1]) if num_messages > 0 else 0
+        sizes = {
+            "text.bin": text_size,
+            "text_end.i64": num_messages * 8,
+            "speaker.i32": num_messages * 4,
+            "debate_id.i32": num_messages * 4,
+            "embedding.f32": num_messages * 4 * self.dim,
+        }
+        for bucket in range(self.keyword_buckets):
+            # Rows are appended in increasing order, so the postings of discarded messages are at the end
+            num_postings = int(np.searchsorted(self.keyword_column(bucket, "row.i32", np.int32), num_messages))
+            sizes[os.path.join("keywords", f"{bucket}.token.i64")] = num_postings * 8
+            sizes[os.path.join("keywords", f"{bucket}.row.i32")] = num_postings * 4
+        for name, size in sizes.items():
+            if os.path.exists(self.path(name)) and os.path.getsize(self.path(name)) > size:
+                os.truncate(self.path(name), size)
+
+    def add_debate(
+        self,
+        topic: str,
+        guests: Iterable[Guest],
+        plan: List[str],
+        summary: str,
+        messages: List[Tuple[str, str]],
+    ) -> int:
+        """
+        Append a finished debate to the archive.
+
+        Args:
+            topic: The debate topic
+            guests: The guests of the debate
+            plan: The steps the debate was planned with
+            summary: The summary of the debate
+            messages: The transcript as (message, speaker) tuples in the order they were said
+
+        Returns:
+            The id of the archived debate
+        """
+        embeddings = self.encoder.encode(
+            [message for message, _ in messages], normalize_embeddings=True
+        ).astype(np.float32).reshape(-1, self.dim)
+        encoded = [message.encode("utf-8") for message, _ in messages]
+        terms = [self.index_terms(message) for message, _ in messages]
+
+        with self.write_lock():
+            # Ids and offsets must come from the archive as it is now, not as it was when this instance was created
+            self.reload()
+            debate_id = len(self.debates)
+            first_message = self.num_messages()
+            self.discard_incomplete(first_message)
+
+            new_speakers = [speaker for _, speaker in messages if speaker not in self.speaker_codes]
+            for speaker in dict.fromkeys(new_speakers):
+                self.speaker_codes[speaker] = len(self.speakers)
+                self.speakers.append(speaker)
+            if new_speakers:
+                # Replace the file at once, so readers never see it half written
+                with open(self.path("speakers.json.tmp"), "w") as file:
+                    json.dump(self.speakers, file)
+                os.replace(self.path("speakers.json.tmp"), self.path("speakers.json"))
+
+            text_path = self.path("text.bin")
+            text_start = os.path.getsize(text_path) if os.path.exists(text_path) else 0
+            with open(text_path, "ab") as file:
+                for message in encoded:
+                    file.write(message)
+            text_end = text_start + np.cumsum([len(message) for message in encoded], dtype=np.int64)
+
+            term_column = np.array([term for row_terms in terms for term in row_terms], dtype=np.int64)
+            row_column = np.repeat(
+                np.arange(first_message, first_message + len(messages), dtype=np.int32),
+                [len(row_terms) for row_terms in terms],
+            )
+            buckets = term_column % self.keyword_buckets
+            order = np.argsort(buckets, kind="stable")  # Keeps the rows of each bucket in increasing order
+            bucket_starts = np.searchsorted(buckets[order], np.arange(self.keyword_buckets + 1))
+            for bucket in range(self.keyword_buckets):
+                postings = order[bucket_starts[bucket]:bucket_starts[bucket + 1]]
+                if len(postings) == 0:
+                    continue
+                with open(self.path(os.path.join("keywords", f"{bucket}.token.i64")), "ab") as file:
+                    term_column[postings].tofile(file)
+                with open(self.path(os.path.join("keywords", f"{bucket}.row.i32")), "ab") as file:
+                    row_column[postings].tofile(file)
+
+            with open(self.path("embedding.f32"), "ab") as file:
+                embeddings.tofile(file)
+            with open(self.path("text_end.i64"), "ab") as file:
+                text_end.tofile(file)
+            with open(self.path("speaker.i32"), "ab") as file:
+                np.array([self.speaker_codes[speaker] for _, speaker in messages], dtype=np.int32).tofile(file)
+            with open(self.path("debate_id.i32"), "ab") as file:
+                np.full(len(messages), debate_id, dtype=np.int32).tofile(file)
+
+            debate = {
+                "id": debate_id,
+                "topic": topic,
+                "guests": [guest.to_dict() for guest in guests],
+                "plan": plan,
+                "summary": summary,
+                "first_message": first_message,
+                "num_messages": len(messages),
+                "archived_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            with open(self.path("debates.jsonl"), "a") as file:
+                file.write(json.dumps(debate) + "\n")
+            self.debates.append(debate)
+        return debate_id
+
+    def transcript(self, debate_id: int) -> List[Tuple[str, str]]:
+        """Return the transcript of an archived debate as (message, speaker) tuples."""
+        debate = self.debates[debate_id]
+        rows = range(debate["first_message"], debate["first_message"] + debate["num_messages"])
+        return [(self.message(row), self.speakers[self.column("speaker.i32", np.int32)[row]]) for row in rows]
+
+    def message(self, row: int) -> str:
+        text_end = self.column("text_end.i64", np.int64)
+        start = int(text_end[row - 1]) if row > 0 else 0
+        with open(self.path("text.bin"), "rb") as file:
+            file.seek(start)
+            return file.read(int(text_end[row]) - start).decode("utf-8")
+
+    def keyword_mask(self, keyword: str, mask: np.ndarray) -> np.ndarray:
+        """
+        Narrow the mask down to the messages containing the keyword.
+
+        Args:
+            keyword: A word or phrase, matched case-insensitively on whole words
+            mask: The messages still considered
+
+        Returns:
+            The mask of matching messages
+        """
+        num_messages = len(mask)
+        terms = self.query_terms(keyword)
+        if not terms:
+            return np.zeros(num_messages, dtype=bool)
+        mask = mask.copy()
+        for term in terms:
+            bucket = term % self.keyword_buckets
+            rows = self.keyword_column(bucket, "row.i32", np.int32)
+            matches = rows[self.keyword_column(bucket, "token.i64", np.int64)[:len(rows)] == term]
+            term_mask = np.zeros(num_messages, dtype=bool)
+            term_mask[matches[matches < num_messages]] = True
+            mask &= term_mask
+        return mask
+
+    def search(
+        self,
+        query: Optional[str] = None,
+        keyword: Optional[str] = None,
+        debate_ids: Optional[List[int]] = None,
+        speaker: Optional[str] = None,
+        top_k: int = 10,
+    ) -> List[Dict[str, Any]]:
+        """
+        Search the archived messages.
+
+        Args:
+            query: Rank messages by semantic similarity to this text
+            keyword: Only consider messages containing this word or phrase
+            debate_ids: Only consider messages from these debates
+            speaker: Only consider messages from this speaker
+            top_k: The maximum number of results
+
+        Returns:
+            The matching messages, best first (newest first without a query)
+        """
+        self.reload()
+        num_messages = self.num_messages()
+        mask = np.ones(num_messages, dtype=bool)
+        if debate_ids is not None:
+            mask &= np.isin(self.column("debate_id.i32", np.int32)[:num_messages], debate_ids)
+        if speaker is not None:
+            if speaker not in self.speaker_codes:
+                return []
+            mask &= self.column("speaker.i32", np.int32)[:num_messages] == self.speaker_codes[speaker]
+        if keyword:
+            mask = self.keyword_mask(keyword, mask)
+
+        if query is None:
+            rows = np.flatnonzero(mask)[::-1][:top_k]
+            scores = [None] * len(rows)
+        else:
+            query_embedding = self.encoder.encode([query], normalize_embeddings=True)[0].astype(np.float32)
+            embeddings = self.column("embedding.f32", np.float32, self.dim)
+            best_rows = np.empty(0, dtype=np.int64)
+            best_scores = np.empty(0, dtype=np.float32)
+            for start in range(0, num_messages, self.search_chunk_size):
+                stop = min(start + self.search_chunk_size, num_messages)
+                candidates = np.flatnonzero(mask[start:stop])
+                if len(candidates) == 0:
+                    continue
+                chunk_scores = embeddings[start + candidates] @ query_embedding
+                best_rows = np.concatenate([best_rows, start + candidates])
+                best_scores = np.concatenate([best_scores, chunk_scores])
+                if len(best_scores) > top_k:
+                    keep = np.argpartition(-best_scores, top_k)[:top_k]
+                    best_rows, best_scores = best_rows[keep], best_scores[keep]
+            order = np.argsort(-best_scores)
+            rows, scores = best_rows[order], best_scores[order].tolist()
+
+        debate_id_column = self.column("debate_id.i32", np.int32)
+        speaker_column = self.column("speaker.i32", np.int32)
+        results = []
+        for row, score in zip(rows, scores):
+            debate = self.debates[debate_id_column[row]]
+            results.append({
+                "debate_id": debate["id"],
+                "topic": debate["topic"],
+                "speaker": self.speakers[speaker_column[row]],
+                "message": self.message(int(row)),
+                "score": score,
+            })
+        return results
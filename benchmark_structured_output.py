@@ -0,0 +1,72 @@
+"""
+Micro-benchmarks of preparing, parsing and validating the structured responses of each schema.
+
+Run with: python benchmark_structured_output.py
+"""
+
+import os
+import json
+import timeit
+from typing import Callable, Dict, Type
+
+from pydantic import BaseModel
+
+from schemas import InviteResponse, DebateResponse, DebatePlan, ReflectResponse
+from structured_output import structured_output
+
+prompts_dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
+delta_size = 4  # Characters per streamed delta, roughly one token
+
+
+def sample_responses() -> Dict[Type[BaseModel], str]:
+    with open(os.path.join(prompts_dir_path, "host", "example_response.txt"), "r") as file:
+        invite_response = json.dumps(json.loads(file.read()))
+    return {
+        InviteResponse: invite_response,
+        DebateResponse: json.dumps({
+            "guest_name": "Dr. Alexei Petrov",
+            "message": "Dr. Petrov, you have argued that sanctions rarely change a government's course. " * 4,
+        }),
+        DebatePlan: json.dumps({"steps": [f"Step {i}: Let the guests discuss aspect {i} of the topic." for i in range(10)]}),
+        ReflectResponse: json.dumps({"done": True}),
+    }
+
+
+def measure(function: Callable[[], object], number: int) -> float:
+    """Return the best time per call in microseconds."""
+    return min(timeit.repeat(function, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    print(f"{'schema':<16}{'format (old)':>14}{'format':>10}{'parse (old)':>13}{'parse':>10}{'stream (old)':>14}{'stream':>10}")
+    for schema, text in sample_responses().items():
+        output = structured_output(schema)
+        prefixes = [text[:end] for end in range(delta_size, len(text) + delta_size, delta_size)]
+
+        # Both stream columns parse the same prefixes, so they only differ in the cost per parse
+        def stream_old():
+            # As the previous implementation did: close the guest list and parse into an unvalidated dict
+            for prefix in prefixes:
+                try:
+                    json.loads(prefix + "]}")
+                except ValueError:
+                    continue
+
+        def stream():
+            for prefix in prefixes:
+                output.parse_partial(prefix)
+
+        results = [
+            measure(lambda: schema.model_json_schema(), 200),
+            measure(lambda: structured_output(schema).text_format, 200),
+            measure(lambda: schema.model_validate(json.loads(text)), 2000),
+            measure(lambda: output.parse(text), 2000),
+            measure(stream_old, 5),
+            measure(stream, 5),
+        ]
+        print(f"{schema.__name__:<16}" + "".join(f"{result:>{width}.1f}" for result, width in zip(results, [14, 10, 13, 10, 14, 10])))
+    print(f"All times in microseconds per response. Streams are parsed once per {delta_size}-character delta.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+This defines cancellation tokens, which let the host abort debate work that is no longer needed.
+"""
+
+import threading
+from typing import Callable, Dict, List, Optional
+
+
+class Cancelled(Exception):
+    """Raised inside work whose cancellation token has been cancelled."""
+
+
+class CancellationToken:
+    """
+    A flag shared between the thread requesting cancellation and the threads doing the work.
+
+    Cancelling a token cancels all of its children and runs the registered callbacks, e.g. to close
+    an open response stream right away instead of waiting for its next chunk. Unregister callbacks and
+    detach children once their work is done, so long-lived tokens do not keep them alive.
+    """
+
+    def __init__(self, parent: Optional["CancellationToken"] = None):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks: List[Callable[[], None]] = []
+        self.detach: Callable[[], None] = lambda: None  # Stops the parent from cancelling this token
+        if parent is not None:
+            self.detach = parent.on_cancel(self.cancel)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.event.is_set()
+
+    def child(self) -> "CancellationToken":
+        """Create a token that is cancelled together with this one, but can also be cancelled alone."""
+        return CancellationToken(parent=self)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Run the callback on cancellation, or right away if already cancelled.
+
+        Returns:
+            A function that unregisters the callback
+        """
+        def unregister() -> None:
+            with self.lock:
+                if callback in self.callbacks:
+                    self.callbacks.remove(callback)
+
+        with self.lock:
+            if not self.cancelled:
+                self.callbacks.append(callback)
+                return unregister
+        callback()
+        return unregister
+
+    def cancel(self) -> None:
+        with self.lock:
+            if self.cancelled:
+                return
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def raise_if_cancelled(self) -> None:
+        if self.cancelled:
+            raise Cancelled()
+
+
+_cancellation_stats: Dict[str, int] = {
+    "calls_skipped": 0,  # Calls cancelled before they were sent
+    "streams_aborted": 0,  # Calls cancelled while the response was streaming
+    "results_dropped": 0,  # Finished results thrown away because they were no longer needed
+    "output_tokens_discarded": 0,  # Tokens received from aborted streams
+    "output_tokens_saved": 0,  # Upper bound: output budget of aborted calls that was never generated
+}
+_cancellation_stats_lock = threading.Lock()
+
+
+def record_cancellation(**counts: int) -> None:
+    """Add to the cancellation counters, e.g. record_cancellation(calls_skipped=1)."""
+    with _cancellation_stats_lock:
+        for key, count in counts.items():
+            _cancellation_stats[key] += count
+
+
+def get_cancellation_stats() -> Dict[str, int]:
+    """Return how much work and how many tokens cancelling has saved so far."""
+    with _cancellation_stats_lock:
+        return dict(_cancellation_stats)
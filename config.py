@@ -2,3 +2,29 @@ mockup = False
 model = "gpt-4.1"
 max_tokens = 5000
 save_responses = True
+
+# Per-role routing: which model each kind of call uses, how many tokens it
+# may produce and how long (in seconds) we wait for it. Responses that hit
+# their limit raise llm.IncompleteResponse, so leave room above what the
+# prompts ask for.
+routing = {
+    "invite": {"model": "gpt-4.1", "max_output_tokens": 3000, "timeout": 60},
+    "plan": {"model": "gpt-4.1-mini", "max_output_tokens": 4000, "timeout": 60},
+    "host": {"model": "gpt-4.1", "max_output_tokens": 1000, "timeout": 30},
+    "guest": {"model": "gpt-4.1", "max_output_tokens": 2000, "timeout": 60},
+    "reflect": {"model": "gpt-4.1-nano", "max_output_tokens": 16, "timeout": 10},
+    "summarize_step": {"model": "gpt-4.1-mini", "max_output_tokens": 500, "timeout": 30},
+    "summarize_debate": {"model": "gpt-4.1", "max_output_tokens": 1000, "timeout": 60},
+}
+# The plan's output limit grows with its number of steps, each of which is described
+plan_output_tokens_per_step = 250
+
+# Semantic topic cache: past topics with a cosine similarity above
+# topic_reuse_threshold reuse their guests and plan as-is, those above
+# topic_warm_start_threshold are passed to the host as a reference.
+topic_cache_dir = "output/topic_cache"
+topic_reuse_threshold = 0.95
+topic_warm_start_threshold = 0.8
+
+# Archive of finished debates
+archive_dir = "output/archive"
@@ -0,0 +1,25 @@
+"""
+This defines a lock on a file, to keep several processes from writing to the same files at once.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows, where only one process may write to the locked files
+    fcntl = None
+
+
+@contextmanager
+def exclusive_lock(path: str, thread_lock: threading.Lock) -> Iterator[None]:
+    """Hold the thread lock and, where possible, an exclusive lock on the file at path."""
+    with thread_lock, open(path, "w") as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
@@ -22,6 +22,16 @@ class Guest:
             f"{self.pronouns['subject']} has the following background: {self.background}"
         )
 
+    def to_dict(self) -> dict:
+        """Serialize the guest into the fields of a GuestTemplate."""
+        return {
+            "name": self.name,
+            "age": self.age,
+            "pronouns": f"{self.pronouns['subject']}/{self.pronouns['object']}",
+            "occupation": self.occupation,
+            "background": self.background,
+        }
+
     def __eq__(self, other):
         if not isinstance(other, Guest):
             return False
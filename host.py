@@ -4,10 +4,12 @@ This defines the host of the talkshow. He is managing the guests and the convers
 
 import os
 from typing import List, Tuple, Generator, Union, Literal, Dict, Any, Optional
-from pydantic import BaseModel
-from guest import Guest, GuestTemplate
-from llm import load_prompt, stream_structured_response, load_txt_file, stream_simple_response, generate_structured_response, generate_simple_response
-from config import mockup, max_tokens, model
+from guest import Guest
+from schemas import InviteResponse, DebateResponse, DebatePlan, ReflectResponse
+from llm import load_prompt, stream_structured_response, load_txt_file, stream_simple_response, generate_structured_response, generate_simple_response, response_errors
+from config import mockup, max_tokens, topic_reuse_threshold, topic_warm_start_threshold, plan_output_tokens_per_step
+from topic_cache import TopicCache
+from cancellation import CancellationToken, Cancelled, record_cancellation
 import tiktoken
 import threading
 from queue import Queue
@@ -15,35 +17,6 @@ from sentence_transformers import SentenceTransformer
 import numpy as np
 
 
-class InviteResponse(BaseModel):
-    guests: list[GuestTemplate]
-    model_config = {
-        "extra": "forbid",  # or 'allow' or 'ignore'
-    }
-
-
-class DebateResponse(BaseModel):
-    guest_name: str
-    message: str
-    model_config = {
-        "extra": "forbid",  # or 'allow' or 'ignore'
-    }
-
-
-class DebatePlan(BaseModel):
-    steps: List[str]
-    model_config = {
-        "extra": "forbid",  # or 'allow' or 'ignore'
-    }
-
-
-class ReflectResponse(BaseModel):
-    done: bool
-    model_config = {
-        "extra": "forbid",  # or 'allow' or 'ignore'
-    }
-
-
 class Host:
     def __init__(self, debate_topic: str, display_mode: Literal["console", "streamlit"] = "console"):
         self.debate_topic = debate_topic
@@ -53,12 +26,40 @@ class Host:
         self.conversation: List[Tuple[str, str, int]] = []  # Stack of messages and their token count, newest first
         self.name_encoder = SentenceTransformer('all-MiniLM-L6-v2')  # Initialize the encoder
         self.guest_name_embeddings = None  # Will store encoded guest names
+        self.topic_cache = TopicCache(self.name_encoder)
+        self.similar_topic = self.topic_cache.lookup(debate_topic)  # (similarity, entry) of the closest past topic
+        self.cancel_token = CancellationToken()  # Cancels all work of this host, see cancel()
+        self.conversation_lock = threading.Lock()
+
+    def cancel(self) -> None:
+        """Abort all work in flight for this host, e.g. when the session it belongs to is gone."""
+        self.cancel_token.cancel()
 
     def update_guest_embeddings(self):
         """Update the guest name embeddings when guests list changes."""
         if self.guests:
             self.guest_name_embeddings = self.name_encoder.encode(list(self.guests.keys()))
 
+    def reusable_topic(self) -> Optional[Dict[str, Any]]:
+        """Return the cached entry of a past topic close enough to be reused as-is."""
+        if self.similar_topic and self.similar_topic[0] >= topic_reuse_threshold:
+            return self.similar_topic[1]
+        return None
+
+    def warm_start(self, instructions: str, kind: Literal["guests", "plan"]) -> str:
+        """Append the guests or plan of a similar past topic to the instructions as a reference."""
+        if not self.similar_topic or self.similar_topic[0] < topic_warm_start_threshold:
+            return instructions
+        entry = self.similar_topic[1]
+        if kind == "guests":
+            reference = "\n".join(str(Guest(**guest_dict)) for guest_dict in entry["guests"])
+        else:
+            reference = "\n".join(f"{i}. {step}" for i, step in enumerate(entry["plan"], 1))
+        return instructions + load_prompt(
+            os.path.join("host", "warm_start_instructions.txt"),
+            {"similar_topic": entry["topic"], "kind": kind, "reference": reference},
+        )
+
     def add_message(self, message: str, name: str):
         """
         Add a message to the conversation stack.
@@ -66,13 +67,16 @@ class Host:
         token_count = self.count_tokens(message)
         self.conversation.insert(0, (message, name, token_count))  
 
-    def retrieve_conversation(self) -> str:
+    def retrieve_conversation(self, pending: List[Tuple[str, str, int]] = ()) -> str:
         """
         Retrieve the conversation from the conversation stack.
+
+        Args:
+            pending: Messages not added to the stack yet, newest first
         """
         tokens_so_far = 0
         messages = []
-        for message, name, token_count in self.conversation:
+        for message, name, token_count in [*pending, *self.conversation]:
             # Filter out guest introductions
             if name == "Host" and "Please welcome " in message:
                 continue
@@ -96,35 +100,52 @@ class Host:
         """
         Fetch the entire list of guests at once.
         """
+        cached = self.reusable_topic()
+        if cached:
+            self.guests = {guest_dict["name"]: Guest(**guest_dict) for guest_dict in cached["guests"]}
+            return self.guests
+
         instructions = load_prompt(
             os.path.join("host", "invite_instructions.txt"),
             {"debate_topic": self.debate_topic},
         )
+        instructions = self.warm_start(instructions, "guests")
         
         if mockup:
-            response: Dict[str, Any] = load_txt_file(os.path.join("host", "example_response.txt"))
+            response = InviteResponse.model_validate(load_txt_file(os.path.join("host", "example_response.txt")))
         else:
-            response: Dict[str, Any] = generate_structured_response("Guests:", instructions=instructions, schema=InviteResponse) 
+            response: InviteResponse = generate_structured_response("Guests:", instructions=instructions, schema=InviteResponse, role="invite", cancel_token=self.cancel_token) 
 
-        self.guests = {guest_dict["name"]: Guest(**guest_dict) for guest_dict in response["guests"]}
+        self.guests = {guest.name: Guest(**guest.model_dump()) for guest in response.guests}
         return self.guests
         
     def invite_guests_one_by_one(self) -> Generator[Guest, None, None]:
         """
         Invite the guests for the talkshow one by one.
         """
+        cached = self.reusable_topic()
+        if cached:
+            for guest_dict in cached["guests"]:
+                guest = Guest(**guest_dict)
+                self.add_guest(guest)
+                yield guest
+            return
+
         instructions = load_prompt(
             os.path.join("host", "invite_instructions.txt"),
             {"debate_topic": self.debate_topic},
         )
-        response: Generator[InviteResponse, None, None] = stream_structured_response("Guests:", instructions=instructions, schema=InviteResponse)
+        instructions = self.warm_start(instructions, "guests")
+        response: Generator[InviteResponse, None, None] = stream_structured_response("Guests:", instructions=instructions, schema=InviteResponse, role="invite", cancel_token=self.cancel_token)
 
+        invited = 0
         for guest_list in response:
-            if guest_list["guests"]:
-                guest_dict = guest_list["guests"][-1]
-                guest = Guest(**guest_dict)
+            # A single update may complete more than one guest
+            for guest_template in guest_list.guests[invited:]:
+                guest = Guest(**guest_template.model_dump())
                 self.add_guest(guest)  # Using new add_guest method
                 yield guest
+            invited = len(guest_list.guests)
 
     def count_tokens(self, text: str) -> int:
         """
@@ -167,79 +188,128 @@ class Host:
         return self.guests[list(self.guests.keys())[best_match_idx]]
 
     def plan_debate(self, num_steps: int = 10) -> List[Tuple[str, str]]:
+        guests = [guest.to_dict() for guest in self.guests.values()]
+        cached = self.reusable_topic()
+        if cached and cached["guests"] == guests and len(cached["plan"]) == num_steps:
+            self.debate_plan = list(cached["plan"])
+            return
+
         instructions = load_prompt(
             os.path.join("host", "plan_instructions.txt"),
             {"debate_topic": self.debate_topic,
              "guests": [str(guest) for guest in self.guests],
              "num_steps": num_steps},
         )
-        response: Dict[str, Any] = generate_structured_response("Response:", instructions=instructions, schema=DebatePlan)
-        self.debate_plan = response["steps"]
+        instructions = self.warm_start(instructions, "plan")
+        response: DebatePlan = generate_structured_response("Response:", instructions=instructions, schema=DebatePlan, role="plan", max_output_tokens=plan_output_tokens_per_step * num_steps, cancel_token=self.cancel_token)
+        self.debate_plan = response.steps
+        self.topic_cache.add(self.debate_topic, guests, list(self.debate_plan))
+        self.similar_topic = (1.0, {"topic": self.debate_topic, "guests": guests, "plan": list(self.debate_plan)})
     
-    def run_debate_cycle(self, result_queue: Queue) -> None:
+    def run_debate_cycle(
+        self,
+        result_queue: Queue,
+        cancel_token: Optional[CancellationToken] = None,
+        host_answered: Optional[threading.Event] = None,
+    ) -> None:
         """
         Run a single cycle of the debate and put results in the queue.
+        host_answered is set once the host's message is paid for, under the conversation lock, so the cycle is only
+        cancelled by run_debate before that.
+        The messages are only added to the conversation if the cycle was not cancelled, otherwise None is put in the queue.
+        If the cycle fails, the error is put in the queue instead, so the debate never waits for it in vain.
         """
+        cancel_token = cancel_token or self.cancel_token
         new_messages = []
-        # First, ask the host whom to address
-        conversation = self.retrieve_conversation()
-        next_step = self.debate_plan[0]
-        instructions = load_prompt(
-            os.path.join("host", "debate_instructions.txt"),
-            {"debate_topic": self.debate_topic,
-             "debate_step": next_step,
-             "guests": [str(guest) for guest in self.guests.values()],
-             "guest_names": list(self.guests.keys()),
-             "conversation": conversation},
-        )
-        print("Querying host")
-        response: Dict[str, Any] = generate_structured_response("Response:", instructions=instructions, schema=DebateResponse)
-        print(f"Response: {response}")
-        guest_name = response["guest_name"]
-        print(f"Guest name: {guest_name}")
-        guest = self.get_guest_by_name(guest_name)
-        message = response["message"]
-        self.add_message(message, "Host")
-        new_messages.append((message, "Your host"))
-        
-        # Then, ask the guest to respond
-        conversation = self.retrieve_conversation()
-        instructions = load_prompt(
-            os.path.join("guest", "debate_instructions.txt"),
-            {"debate_topic": self.debate_topic,
-             "guest": str(guest),
-             "conversation": conversation},
-        )
-        print("Querying guest")
-        response: str = generate_simple_response("Response:", instructions=instructions)
-        self.add_message(response, guest.name)
-        new_messages.append((response, guest.name))
-        
+        try:
+            # First, ask the host whom to address
+            conversation = self.retrieve_conversation()
+            next_step = self.debate_plan[0]
+            instructions = load_prompt(
+                os.path.join("host", "debate_instructions.txt"),
+                {"debate_topic": self.debate_topic,
+                 "debate_step": next_step,
+                 "guests": [str(guest) for guest in self.guests.values()],
+                 "guest_names": list(self.guests.keys()),
+                 "conversation": conversation},
+            )
+            print("Querying host")
+            response: DebateResponse = generate_structured_response("Response:", instructions=instructions, schema=DebateResponse, role="host", cancel_token=cancel_token)
+            print(f"Response: {response}")
+            guest_name = response.guest_name
+            print(f"Guest name: {guest_name}")
+            guest = self.get_guest_by_name(guest_name)
+            message = response.message
+            new_messages.append((message, "Host"))
+            with self.conversation_lock:
+                cancel_token.raise_if_cancelled()
+                if host_answered is not None:
+                    host_answered.set()
+
+            # Then, ask the guest to respond
+            conversation = self.retrieve_conversation(pending=[(message, "Host", self.count_tokens(message))])
+            instructions = load_prompt(
+                os.path.join("guest", "debate_instructions.txt"),
+                {"debate_topic": self.debate_topic,
+                 "guest": str(guest),
+                 "conversation": conversation},
+            )
+            print("Querying guest")
+            response: str = generate_simple_response("Response:", instructions=instructions, role="guest", cancel_token=cancel_token)
+            new_messages.append((response, guest.name))
+
+            with self.conversation_lock:
+                cancel_token.raise_if_cancelled()
+                for message, name in new_messages:
+                    self.add_message(message, name)
+        except Cancelled:
+            if new_messages:
+                record_cancellation(results_dropped=len(new_messages))
+            result_queue.put(None)
+            return
+        except Exception as error:
+            result_queue.put(error)
+            return
+
         # Put the results in the queue
-        result_queue.put(new_messages)
+        result_queue.put([(message, "Your host" if name == "Host" else name) for message, name in new_messages])
 
-    def reflect_on_debate(self, planning_queue: Queue) -> None:
+    def reflect_on_debate(self, planning_queue: Queue, cancel_token: Optional[CancellationToken] = None) -> None:
         """
-        Reflect on the debate and put the results in the queue.
+        Reflect on the debate and put the results in the queue, None if it was cancelled or the error if it failed.
+        Reflection is only an optimization, so if the call times out or is cut off, the step is simply not done yet.
         """
+        cancel_token = cancel_token or self.cancel_token
         if len(self.debate_plan) > 1:
             next_step = self.debate_plan[1]
         else:
             next_step = "No more steps"
 
-        instructions = load_prompt(
-            os.path.join("host", "reflect_instructions.txt"),
-            {"debate_topic": self.debate_topic,
-             "conversation": self.retrieve_conversation(),
-             "current_step": self.debate_plan[0],
-             "next_step": next_step},
-        )
-        response: Dict[str, Any] = generate_structured_response("Response:", instructions=instructions, schema=ReflectResponse)
-        planning_queue.put(response["done"])
+        try:
+            instructions = load_prompt(
+                os.path.join("host", "reflect_instructions.txt"),
+                {"debate_topic": self.debate_topic,
+                 "conversation": self.retrieve_conversation(),
+                 "current_step": self.debate_plan[0],
+                 "next_step": next_step},
+            )
+            response: ReflectResponse = generate_structured_response("Response:", instructions=instructions, schema=ReflectResponse, role="reflect", cancel_token=cancel_token)
+        except Cancelled:
+            planning_queue.put(None)
+            return
+        except response_errors as error:
+            print(f"Reflection failed, staying on the current step: {error}")
+            planning_queue.put(False)
+            return
+        except Exception as error:
+            planning_queue.put(error)
+            return
+        planning_queue.put(response.done)
     
     def run_debate(self) -> Generator[Tuple[str, str], None, None]:
         """
         Run the debate.
+        Closing the generator, e.g. when the Streamlit session reruns, cancels the work still in flight.
         """
         self.update_guest_embeddings()
         # Start by introducing the topic and the guests
@@ -247,39 +317,69 @@ class Host:
         self.add_message(welcome_message, "Host")
         result_queue = Queue()
         planning_queue = Queue()
+        debate_token = self.cancel_token.child()
         new_messages = [(welcome_message, "Your host")]  # Start with welcome message
         done = False
-        while self.debate_plan:  # Continue until debate plan is empty
-            if done:
-                if len(self.debate_plan) > 1:
-                    self.debate_plan.pop(0)
-                else:
-                    self.debate_plan = []
-                    break
-            # Prepare next debate cycle in another thread
-            debate_cycle_thread = threading.Thread(
-                target=self.run_debate_cycle,
-                daemon=True,
-                args=(result_queue,)
-            )
-            debate_cycle_thread.start()
-            
-            # Reflect on the debate in another thread
-            reflect_thread = threading.Thread(
-                target=self.reflect_on_debate,
-                daemon=True,
-                args=(planning_queue,)
-            )
-            reflect_thread.start()
-            
-            # Yield messages from previous cycle
-            for message, name in new_messages:
-                yield message, name
+        step_exchanges = 0  # Exchanges kept for the current step
+        try:
+            while self.debate_plan:  # Continue until debate plan is empty
+                if done:
+                    if len(self.debate_plan) > 1:
+                        self.debate_plan.pop(0)
+                        step_exchanges = 0
+                    else:
+                        self.debate_plan = []
+                        break
+                # Prepare next debate cycle in another thread
+                cycle_token = debate_token.child()
+                host_answered = threading.Event()
+                debate_cycle_thread = threading.Thread(
+                    target=self.run_debate_cycle,
+                    daemon=True,
+                    args=(result_queue, cycle_token, host_answered)
+                )
+                debate_cycle_thread.start()
+
+                # Reflect on the debate in another thread
+                reflect_thread = threading.Thread(
+                    target=self.reflect_on_debate,
+                    daemon=True,
+                    args=(planning_queue, debate_token)
+                )
+                reflect_thread.start()
 
-            # Wait for the debate cycle to finish and get results
-            debate_cycle_thread.join()
-            new_messages = result_queue.get()
+                # Yield messages from previous cycle
+                for message, name in new_messages:
+                    yield message, name
 
-            # Wait for the reflection to finish and get results
-            reflect_thread.join()
-            done = planning_queue.get()
+                # Wait for the reflection to finish and get results
+                reflect_thread.join()
+                done = planning_queue.get()
+                if isinstance(done, Exception):
+                    raise done
+
+                # If the current step is already done, the exchange still being generated for it is not needed.
+                # Keep it anyway if it is the step's only one or the host's message is already paid for.
+                with self.conversation_lock:
+                    if done and step_exchanges > 0 and not host_answered.is_set():
+                        cycle_token.cancel()
+
+                # Wait for the debate cycle to finish and get results
+                debate_cycle_thread.join()
+                cycle_token.detach()
+                new_messages = result_queue.get()
+                if isinstance(new_messages, Exception):
+                    raise new_messages
+                new_messages = new_messages or []
+                if new_messages:
+                    step_exchanges += 1
+
+                if debate_token.cancelled:
+                    return
+
+            # Messages of the last cycle were already added to the conversation
+            for message, name in new_messages:
+                yield message, name
+        finally:
+            debate_token.cancel()
+            debate_token.detach()
@@ -1,12 +1,21 @@
 import os
 import json
-from typing import Dict, Any, Generator
+import time
+import threading
+from typing import Dict, Any, Generator, Optional, Type, Literal
 from dotenv import load_dotenv
-from openai import OpenAI
-from openai.types.responses import ResponseTextDeltaEvent
-from pydantic import BaseModel
+from openai import OpenAI, APIError
+from openai.types.responses import (
+    ResponseTextDeltaEvent,
+    ResponseCompletedEvent,
+    ResponseIncompleteEvent,
+    ResponseFailedEvent,
+    ResponseErrorEvent,
+)
 from langchain_core.prompts import PromptTemplate
-from config import model, save_responses
+from config import model as default_model, save_responses, routing
+from cancellation import CancellationToken, Cancelled, record_cancellation
+from structured_output import T, structured_output
 from datetime import datetime
 
 user_dir = os.path.expanduser("~")
@@ -40,108 +49,239 @@ def _save_response(system_prompt: str, response_text: str, prefix: str = "respon
     print(f"Response saved to {filepath}")
 
 
+def _route(role: Optional[str], model: Optional[str], max_output_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """Resolve the request options for a role from the routing table."""
+    if role is None:
+        options = {"model": model or default_model}
+        if max_output_tokens is not None:
+            options["max_output_tokens"] = max_output_tokens
+        return options
+    route = routing[role]
+    return {
+        "model": model or route["model"],
+        "max_output_tokens": max_output_tokens or route["max_output_tokens"],
+        "timeout": route["timeout"],
+    }
+
+
+class IncompleteResponse(Exception):
+    """Raised when a response ends before it is complete, e.g. because it hit max_output_tokens."""
+
+
+# Errors a single call can fail with, e.g. timing out or hitting its output limit, that callers may recover from
+response_errors = (IncompleteResponse, APIError)
+
+
+_role_stats: Dict[str, Dict[str, float]] = {}
+_role_stats_lock = threading.Lock()
+
+
+def _record_stats(
+    role: Optional[str],
+    started: float,
+    usage: Any,
+    outcome: Literal["completed", "incomplete", "failed"] = "completed",
+) -> None:
+    """Accumulate latency, token usage and outcome of a finished call under its role."""
+    latency = time.perf_counter() - started
+    with _role_stats_lock:
+        stats = _role_stats.setdefault(
+            role or "default",
+            {"calls": 0, "incomplete": 0, "failed": 0, "latency": 0.0, "input_tokens": 0, "output_tokens": 0},
+        )
+        stats["calls"] += 1
+        if outcome != "completed":
+            stats[outcome] += 1
+        stats["latency"] += latency
+        if usage is not None:
+            stats["input_tokens"] += usage.input_tokens
+            stats["output_tokens"] += usage.output_tokens
+
+
+def get_role_stats() -> Dict[str, Dict[str, float]]:
+    """Return per-role call count, incomplete and failed calls, average latency (s) and average token usage."""
+    with _role_stats_lock:
+        return {
+            role: {
+                "calls": stats["calls"],
+                "incomplete": stats["incomplete"],
+                "failed": stats["failed"],
+                "avg_latency": stats["latency"] / stats["calls"],
+                "avg_input_tokens": stats["input_tokens"] / stats["calls"],
+                "avg_output_tokens": stats["output_tokens"] / stats["calls"],
+            }
+            for role, stats in _role_stats.items()
+        }
+
+
+def _stream_text(
+    cancel_token: Optional[CancellationToken],
+    role: Optional[str],
+    model: Optional[str],
+    max_output_tokens: Optional[int] = None,
+    **request: Any,
+) -> Generator[str, None, None]:
+    """
+    Stream the text deltas of a response.
+
+    Cancelling the token closes the stream mid-flight and raises Cancelled in the consumer.
+    A response that ends without completing raises IncompleteResponse, so truncated text is never passed on.
+    """
+    if cancel_token is not None and cancel_token.cancelled:
+        record_cancellation(calls_skipped=1)
+        raise Cancelled()
+    route = _route(role, model, max_output_tokens)
+    started = time.perf_counter()
+    response = client.responses.create(**route, **request, stream=True)
+    unregister = cancel_token.on_cancel(response.close) if cancel_token is not None else None
+
+    received = 0
+    outcome = None
+    reason = None
+    usage = None
+    try:
+        for chunk in response:
+            if cancel_token is not None and cancel_token.cancelled:
+                break
+            if isinstance(chunk, ResponseTextDeltaEvent):
+                received += 1  # A delta is roughly one token
+                yield chunk.delta
+            elif isinstance(chunk, ResponseCompletedEvent):
+                outcome = "completed"
+                _record_stats(role, started, chunk.response.usage)
+            elif isinstance(chunk, ResponseIncompleteEvent):
+                outcome = "incomplete"
+                usage = chunk.response.usage
+                if chunk.response.incomplete_details:
+                    reason = chunk.response.incomplete_details.reason
+            elif isinstance(chunk, ResponseFailedEvent):
+                outcome = "failed"
+                usage = chunk.response.usage
+                if chunk.response.error:
+                    reason = chunk.response.error.message
+            elif isinstance(chunk, ResponseErrorEvent):
+                outcome = "failed"
+                reason = chunk.message
+    except Exception:
+        # Closing the stream from another thread makes the iteration fail
+        if cancel_token is None or not cancel_token.cancelled:
+            _record_stats(role, started, usage, "failed")
+            raise
+    finally:
+        if unregister is not None:
+            unregister()
+        response.close()
+
+    if outcome == "completed":
+        return
+    if cancel_token is not None and cancel_token.cancelled:
+        record_cancellation(
+            streams_aborted=1,
+            output_tokens_discarded=received,
+            output_tokens_saved=max(route.get("max_output_tokens", received) - received, 0),
+        )
+        raise Cancelled()
+    _record_stats(role, started, usage, outcome or "failed")
+    raise IncompleteResponse(
+        f"Response for role {role or 'default'} ended {outcome or 'without completing'}"
+        + (f": {reason}" if reason else "")
+    )
+
+
 def generate_structured_response(
     input: str,
-    schema: BaseModel,
+    schema: Type[T],
     instructions: str = None,
-    model: str = model,
+    model: Optional[str] = None,
+    role: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
     save_response: bool = save_responses,
-) -> Dict[str, Any]:
+    cancel_token: Optional[CancellationToken] = None,
+) -> T:
     """Generate a structured response without streaming."""
     print("Generating structured response")
-    response = client.responses.create(
-        model=model,
+    output = structured_output(schema)
+    output_text = "".join(_stream_text(
+        cancel_token,
+        role,
+        model,
+        max_output_tokens,
         input=input,
         instructions=instructions,
-        text={
-            "format": {
-                "type": "json_schema",
-                "name": "BidResponse",
-                "schema": schema.model_json_schema(),
-            }
-        },
-        stream=False,
-    )
+        text=output.text_format,
+    ))
     print("Response generated")
     
     if save_response:
-        _save_response(response.output_text, "structured_response")
+        _save_response(output_text, "structured_response")
     
-    return json.loads(response.output_text)
+    return output.parse(output_text)
 
 
 def stream_structured_response(
     input: str,
-    schema: BaseModel,
+    schema: Type[T],
     instructions: str = None,
-    model: str = model,
-) -> Generator[Dict[str, Any], None, None]:
-    """Stream a structured response."""
+    model: Optional[str] = None,
+    role: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
+    cancel_token: Optional[CancellationToken] = None,
+) -> Generator[T, None, None]:
+    """Stream a structured response, yielding a validated instance whenever more of it is complete."""
     print("Starting structured response stream")
-    response = client.responses.create(
-        model=model,
+    output = structured_output(schema)
+    response = _stream_text(
+        cancel_token,
+        role,
+        model,
+        max_output_tokens,
         input=input,
         instructions=instructions,
-        text={
-            "format": {
-                "type": "json_schema",
-                "name": "BidResponse",
-                "schema": schema.model_json_schema(),
-            }
-        },
-        stream=True,
+        text=output.text_format,
     )
     
     complete_response = ""
-    count = 0
-    for chunk in response:
-        if isinstance(chunk, ResponseTextDeltaEvent):
-            for char in chunk.delta:
-                complete_response += char
-                try:
-                    yield json.loads(complete_response + "]}")
-                    print(count)
-                    count += 1
-                except:
-                    continue
+    latest = None
+    for delta in response:
+        complete_response += delta
+        partial = output.parse_partial(complete_response)
+        if partial is not None and partial != latest:
+            latest = partial
+            yield partial
+
+    final = output.parse(complete_response)
+    if final != latest:
+        yield final
 
 
 def generate_simple_response(
     input: str, 
     instructions: str = None, 
-    model: str = model,
+    model: Optional[str] = None,
+    role: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
     save_response: bool = save_responses,
+    cancel_token: Optional[CancellationToken] = None,
 ) -> str:
     """Generate a simple response without streaming."""
-    response = client.responses.create(
-        model=model,
-        input=input,
-        instructions=instructions,
-        stream=False
-    )
+    output_text = "".join(_stream_text(cancel_token, role, model, max_output_tokens, input=input, instructions=instructions))
     
     if save_response:
-        _save_response(response.output_text, "simple_response")
+        _save_response(output_text, "simple_response")
     
-    return response.output_text
+    return output_text
 
 
 def stream_simple_response(
     input: str, 
     instructions: str = None, 
-    model: str = model,
+    model: Optional[str] = None,
+    role: Optional[str] = None,
+    max_output_tokens: Optional[int] = None,
+    cancel_token: Optional[CancellationToken] = None,
 ) -> Generator[str, None, None]:
     """Stream a simple response."""
-    response = client.responses.create(
-        model=model,
-        input=input,
-        instructions=instructions,
-        stream=True
-    )
-    
-    for chunk in response:
-        if isinstance(chunk, ResponseTextDeltaEvent):
-            yield chunk.delta
+    yield from _stream_text(cancel_token, role, model, max_output_tokens, input=input, instructions=instructions)
 
 
 prompts_dir_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "prompts")
@@ -0,0 +1,36 @@
+"""
+This defines the schemas of the structured responses the host asks for.
+"""
+
+from typing import List
+from pydantic import BaseModel
+from guest import GuestTemplate
+
+
+class InviteResponse(BaseModel):
+    guests: list[GuestTemplate]
+    model_config = {
+        "extra": "forbid",  # or 'allow' or 'ignore'
+    }
+
+
+class DebateResponse(BaseModel):
+    guest_name: str
+    message: str
+    model_config = {
+        "extra": "forbid",  # or 'allow' or 'ignore'
+    }
+
+
+class DebatePlan(BaseModel):
+    steps: List[str]
+    model_config = {
+        "extra": "forbid",  # or 'allow' or 'ignore'
+    }
+
+
+class ReflectResponse(BaseModel):
+    done: bool
+    model_config = {
+        "extra": "forbid",  # or 'allow' or 'ignore'
+    }
@@ -0,0 +1,66 @@
+"""
+This defines how structured responses are requested and parsed. Each schema is prepared once and responses are validated straight into it.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Generic, Optional, Type, TypeVar
+from pydantic import BaseModel, ValidationError
+from pydantic_core import from_json
+
+T = TypeVar("T", bound=BaseModel)
+
+
+class StructuredOutput(Generic[T]):
+    """
+    The response format and parsers of a schema.
+
+    Use structured_output(schema) instead of creating this directly, so the JSON schema is only generated once per schema.
+    """
+
+    def __init__(self, schema: Type[T]):
+        self.schema = schema
+        self.text_format: Dict[str, Any] = {
+            "format": {
+                "type": "json_schema",
+                "name": schema.__name__,
+                "schema": schema.model_json_schema(),
+            }
+        }
+
+    def parse(self, text: str) -> T:
+        """Parse and validate a complete response in one pass, without building an intermediate dict."""
+        return self.schema.model_validate_json(text)
+
+    def parse_partial(self, text: str) -> Optional[T]:
+        """
+        Parse the complete part of an unfinished response.
+
+        Args:
+            text: The response received so far
+
+        Returns:
+            An instance holding every list element received completely, or None if no field is complete yet
+        """
+        try:
+            data = from_json(text, allow_partial=True)
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        while True:
+            try:
+                return self.schema.model_validate(data)
+            except ValidationError:
+                # Only the field written last can be incomplete. If it is a list, its last element may
+                # still be missing fields, so retry without it.
+                if not data:
+                    return None
+                last_field = next(reversed(data))
+                if not isinstance(data[last_field], list) or not data[last_field]:
+                    return None
+                data = {**data, last_field: data[last_field][:-1]}
+
+
+@lru_cache(maxsize=None)
+def structured_output(schema: Type[T]) -> StructuredOutput[T]:
+    return StructuredOutput(schema)
@@ -1,9 +1,11 @@
 import os
 import threading
+from typing import Optional
 
-from llm import generate_simple_response, load_prompt
+from llm import generate_simple_response, load_prompt, response_errors
+from cancellation import CancellationToken, Cancelled
 
-def summarize_step(messages: list[tuple[str, str]], debate_topic: str) -> str:
+def summarize_step(messages: list[tuple[str, str]], debate_topic: str, cancel_token: Optional[CancellationToken] = None) -> str:
     """
     Summarize a single step of the debate.
     """
@@ -12,9 +14,9 @@ def summarize_step(messages: list[tuple[str, str]], debate_topic: str) -> str:
         {"section": "\n".join(f"{name}: {message}" for message, name in messages),
          "debate_topic": debate_topic}
     )
-    return generate_simple_response("Summary:", instructions=instructions)
+    return generate_simple_response("Summary:", instructions=instructions, role="summarize_step", cancel_token=cancel_token)
 
-def summarize_steps(messages: list[tuple[str, str]], debate_topic: str) -> str:
+def summarize_steps(messages: list[tuple[str, str]], debate_topic: str, cancel_token: Optional[CancellationToken] = None) -> str:
     """
     Summarize the steps of the debate.
     """
@@ -39,9 +41,18 @@ def summarize_steps(messages: list[tuple[str, str]], debate_topic: str) -> str:
     threads = []
     summaries = []
     
+    def summarize_group(group: list[tuple[str, str]]) -> None:
+        try:
+            summaries.append(summarize_step(group, debate_topic, cancel_token))
+        except Cancelled:
+            pass
+        except response_errors as error:
+            # The summary of the whole debate can do without a section
+            print(f"Skipping a section of the summary: {error}")
+
     for group in message_groups:
         thread = threading.Thread(
-            target=lambda g: summaries.append(summarize_step(g, debate_topic)),
+            target=summarize_group,
             args=(group,)
         )
         threads.append(thread)
@@ -50,17 +61,19 @@ def summarize_steps(messages: list[tuple[str, str]], debate_topic: str) -> str:
     # Wait for all threads to complete
     for thread in threads:
         thread.join()
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
     
     # Combine all summaries with their indices
     return "\n\n".join(f"{i+1}. {summary}" for i, summary in enumerate(summaries))
 
-def summarize_debate(messages: list[tuple[str, str]], debate_topic: str) -> str:
+def summarize_debate(messages: list[tuple[str, str]], debate_topic: str, cancel_token: Optional[CancellationToken] = None) -> str:
     """
     Summarize the entire debate.
     """
     instructions = load_prompt(
         os.path.join("summarizer", "summarize_debate.txt"),
-        {"sections": summarize_steps(messages, debate_topic),
+        {"sections": summarize_steps(messages, debate_topic, cancel_token),
          "debate_topic": debate_topic}
     )
-    return generate_simple_response("Summary:", instructions=instructions)
+    return generate_simple_response("Summary:", instructions=instructions, role="summarize_debate", cancel_token=cancel_token)
@@ -0,0 +1,163 @@
+"""
+This defines a persistent cache of past debate topics, so that guests and plans can be reused for similar topics.
+"""
+
+import os
+import json
+import threading
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+from config import topic_cache_dir
+from file_lock import exclusive_lock
+
+# Shared by all TopicCache instances, since every Host creates its own
+_topic_cache_lock = threading.Lock()
+
+
+class _TopicIndex:
+    """
+    The entries and embeddings of one cache directory, loaded once per process.
+
+    Both files are only appended to, so refreshing only reads what was added since the last refresh.
+    """
+
+    def __init__(self, cache_dir: str, dim: int):
+        self.entries_path = os.path.join(cache_dir, "entries.jsonl")
+        self.embeddings_path = os.path.join(cache_dir, "embeddings.f32")
+        self.lock_path = os.path.join(cache_dir, "lock")
+        self.dim = dim
+        self.row_size = np.dtype(np.float32).itemsize * dim
+        self.clear()
+
+    def clear(self) -> None:
+        self.entries: List[Dict[str, Any]] = []
+        self.entry_ends: List[int] = []  # Offset in the entries file at which each entry ends
+        self.buffer = np.empty((1024, self.dim), dtype=np.float32)  # Grows by doubling
+        self.num_embeddings = 0
+
+    @property
+    def size(self) -> int:
+        """Number of entries written completely, i.e. with their embedding."""
+        return min(len(self.entries), self.num_embeddings)
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self.buffer[:self.size]
+
+    def file_sizes(self) -> Tuple[int, int]:
+        entries_size = os.path.getsize(self.entries_path) if os.path.exists(self.entries_path) else 0
+        embeddings_size = os.path.getsize(self.embeddings_path) if os.path.exists(self.embeddings_path) else 0
+        return entries_size, embeddings_size
+
+    def refresh(self) -> None:
+        """Read the entries and embeddings appended since the last refresh."""
+        entries_size, embeddings_size = self.file_sizes()
+        entries_read = self.entry_ends[-1] if self.entry_ends else 0
+        if entries_size < entries_read or embeddings_size < self.num_embeddings * self.row_size:
+            # The files were cut back after an interrupted write, start over
+            self.clear()
+            entries_read = 0
+
+        if entries_size > entries_read:
+            with open(self.entries_path, "rb") as file:
+                file.seek(entries_read)
+                data = file.read(entries_size - entries_read)
+            # A line without a newline is still being written
+            for line in data[:data.rfind(b"\n") + 1].splitlines(keepends=True):
+                entries_read += len(line)
+                self.entries.append(json.loads(line))
+                self.entry_ends.append(entries_read)
+
+        rows = embeddings_size // self.row_size
+        if rows > self.num_embeddings:
+            with open(self.embeddings_path, "rb") as file:
+                file.seek(self.num_embeddings * self.row_size)
+                new = np.fromfile(file, dtype=np.float32, count=(rows - self.num_embeddings) * self.dim)
+            self.append_embeddings(new.reshape(-1, self.dim))
+
+    def append_embeddings(self, embeddings: np.ndarray) -> None:
+        needed = self.num_embeddings + len(embeddings)
+        if needed > len(self.buffer):
+            buffer = np.empty((max(needed, 2 * len(self.buffer)), self.dim), dtype=np.float32)
+            buffer[:self.num_embeddings] = self.buffer[:self.num_embeddings]
+            self.buffer = buffer
+        self.buffer[self.num_embeddings:needed] = embeddings
+        self.num_embeddings = needed
+
+    def repair(self) -> None:
+        """
+        Cut both files back to the entries written completely, should a previous add have failed halfway.
+        Only call this holding the exclusive lock, otherwise it may cut off another process's add in progress.
+        """
+        entries_size, embeddings_size = self.file_sizes()
+        size = self.size
+        entries_end = self.entry_ends[size - 1] if size > 0 else 0
+        if entries_size > entries_end:
+            os.truncate(self.entries_path, entries_end)
+        if embeddings_size > size * self.row_size:
+            os.truncate(self.embeddings_path, size * self.row_size)
+        del self.entries[size:]
+        del self.entry_ends[size:]
+        self.num_embeddings = size
+
+
+# One index per cache directory
+_topic_indexes: Dict[str, _TopicIndex] = {}
+
+
+class TopicCache:
+    """
+    Maps embeddings of past topics to their guest rosters and debate plans.
+
+    Entries are appended to a JSON lines file and their normalized embeddings to a raw
+    float32 file, so adding a topic never rewrites what is already on disk.
+    """
+
+    def __init__(self, encoder: SentenceTransformer, cache_dir: str = topic_cache_dir):
+        self.encoder = encoder
+        os.makedirs(cache_dir, exist_ok=True)
+        with _topic_cache_lock:
+            key = os.path.abspath(cache_dir)
+            if key not in _topic_indexes:
+                _topic_indexes[key] = _TopicIndex(cache_dir, encoder.get_sentence_embedding_dimension())
+            self.index = _topic_indexes[key]
+
+    def encode(self, topic: str) -> np.ndarray:
+        return self.encoder.encode([topic], normalize_embeddings=True)[0].astype(np.float32)
+
+    def lookup(self, topic: str) -> Optional[Tuple[float, Dict[str, Any]]]:
+        """
+        Find the most similar past topic.
+
+        Args:
+            topic: The debate topic to search for
+
+        Returns:
+            The cosine similarity and the cached entry, or None if the cache is empty
+        """
+        with _topic_cache_lock:
+            self.index.refresh()
+            embeddings = self.index.embeddings
+            entries = self.index.entries
+        if len(embeddings) == 0:
+            return None
+        similarities = embeddings @ self.encode(topic)
+        best_match_idx = int(np.argmax(similarities))
+        return float(similarities[best_match_idx]), entries[best_match_idx]
+
+    def add(self, topic: str, guests: List[Dict[str, Any]], plan: List[str]) -> None:
+        """Store the guests and plan of a topic."""
+        entry = {"topic": topic, "guests": guests, "plan": plan}
+        embedding = self.encode(topic)
+        # Excludes adds of other processes too, so an unfinished entry can only be left over from a failed add
+        with exclusive_lock(self.index.lock_path, _topic_cache_lock):
+            self.index.refresh()
+            self.index.repair()
+            with open(self.index.entries_path, "a") as file:
+                file.write(json.dumps(entry) + "\n")
+            with open(self.index.embeddings_path, "ab") as file:
+                embedding.tofile(file)
+            self.index.refresh()